@@ -0,0 +1,164 @@
+from __future__ import print_function
+
+import os
+import pickle
+import subprocess
+import sys
+from multiprocessing import Pool
+
+from pytest import mark, raises
+from vclock import VClockArray, VClockDict, VClockDictInt, VClockBatch, SharedVClockBatch, map_batches
+from vclock.batch import shared_memory
+
+
+needs_shared_memory = mark.skipif(shared_memory is None, reason="requires multiprocessing.shared_memory")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# attach by name, from a child process and from the owner, then let the owner unlink
+ATTACH_BY_NAME = """
+import multiprocessing, sys
+from vclock import VClockBatch, VClockDictInt, SharedVClockBatch
+
+clocks = [VClockDictInt({1: i}) for i in range(10)]
+
+def work(name):
+    with SharedVClockBatch.attach(name, VClockDictInt) as attached:
+        sys.exit(0 if list(attached) == clocks else 1)
+
+if __name__ == '__main__':
+    with VClockBatch.from_clocks(clocks).share() as shared:
+        child = multiprocessing.get_context('fork').Process(target=work, args=(shared.name,))
+        child.start()
+        child.join()
+        assert child.exitcode == 0
+        with SharedVClockBatch.attach(shared.name, VClockDictInt) as attached:
+            assert list(attached) == clocks
+"""
+
+CLOCKS = [
+    (VClockArray, [VClockArray([3, 4, 1]), VClockArray(), VClockArray([0, 7])]),
+    (VClockDictInt, [VClockDictInt({0: 3, 1: 4, 2: 1}), VClockDictInt(), VClockDictInt({17: 9})]),
+    (VClockDict, [VClockDict({'aa': 3, 'ab': 4, 'ac': 1}), VClockDict(), VClockDict({'zz': 2})]),
+]
+
+
+def _bump(clock):
+    return clock.increment('ab' if isinstance(clock, VClockDict) else 1)
+
+
+@mark.parametrize("cls,clocks", CLOCKS)
+def test_pickle_clock(cls, clocks):
+    for clock in clocks:
+        loaded = pickle.loads(pickle.dumps(clock, pickle.HIGHEST_PROTOCOL))
+        assert loaded.__class__ is cls
+        assert loaded == clock
+
+
+@mark.parametrize("cls,clocks", CLOCKS)
+def test_batch_roundtrip(cls, clocks):
+    batch = VClockBatch.from_clocks(clocks)
+    assert batch.clock_class is cls
+    assert len(batch) == len(clocks)
+    assert list(batch) == clocks
+    assert batch[-1] == clocks[-1]
+    assert batch.serialized(0) == clocks[0].serialize()
+    with raises(IndexError):
+        batch[len(clocks)]
+    # slices and pickles only carry their own range
+    tail = pickle.loads(pickle.dumps(batch[1:], pickle.HIGHEST_PROTOCOL))
+    assert list(tail) == clocks[1:]
+    assert len(tail.data) == sum(len(clock.serialize()) for clock in clocks[1:])
+
+
+def test_batch_from_serialized():
+    clocks = [VClockDictInt({0: 3}), VClockDictInt({1: 1, 4: 2})]
+    batch = VClockBatch.from_serialized([clock.serialize() for clock in clocks], VClockDictInt)
+    assert list(batch) == clocks
+
+
+def test_batch_rejects_bad_clocks():
+    with raises(TypeError):
+        VClockBatch.from_clocks([VClockArray([1]), VClockDictInt({0: 1})])
+    # too large for the codec, would not round-trip
+    with raises(ValueError):
+        VClockBatch.from_clocks([VClockDictInt({300: 1})])
+
+
+@needs_shared_memory
+@mark.parametrize("cls,clocks", CLOCKS)
+def test_shared_batch(cls, clocks):
+    with VClockBatch.from_clocks(clocks).share() as shared:
+        assert list(shared) == clocks
+        # pickling only sends the name, and reattaches to the same block
+        data = pickle.dumps(shared, pickle.HIGHEST_PROTOCOL)
+        assert len(data) < 200
+        with pickle.loads(data) as attached:
+            assert not attached.owner
+            assert list(attached) == clocks
+
+
+@needs_shared_memory
+def test_shared_batch_slice_outlives_close():
+    clocks = CLOCKS[1][1]
+    with VClockBatch.from_clocks(clocks).share() as shared:
+        tail = shared.batch[1:]
+        assert list(tail) == clocks[1:]
+    # closing did not fail on the slice, which is unusable once the block is gone
+    with raises(ValueError):
+        tail[0]
+
+
+@needs_shared_memory
+@mark.skipif(os.name != 'posix', reason="uses fork")
+def test_shared_batch_attach_by_name():
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    proc = subprocess.run([sys.executable, '-c', ATTACH_BY_NAME], env=env, cwd=ROOT,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=60)
+    assert proc.returncode == 0, proc.stderr
+    # the resource tracker shares our stderr, and complains if an attach dropped the owner's entry
+    assert proc.stderr == b''
+
+
+@mark.parametrize("shared", [True, False])
+@mark.parametrize("cls,clocks", CLOCKS)
+def test_map_batches(cls, clocks, shared):
+    clocks = clocks * 5
+    results = map_batches(_bump, clocks, processes=2, batch_size=4, shared=shared)
+    assert results == [_bump(clock) for clock in clocks]
+    assert map_batches(_bump, VClockBatch.from_clocks(clocks), processes=2, shared=shared) == results
+    assert map_batches(_bump, [], processes=1) == []
+
+
+@mark.parametrize("shared", [True, False])
+def test_map_batches_many_tasks(shared):
+    # many more ranges than 4 * processes, so pool.map sends several tasks per chunk
+    clocks = [VClockDictInt({1: i % 200}) for i in range(50)]
+    expected = [_bump(clock) for clock in clocks]
+    assert map_batches(_bump, clocks, processes=2, batch_size=1, shared=shared) == expected
+    pool = Pool(2)
+    try:
+        assert map_batches(_bump, clocks, pool=pool, batch_size=1, shared=shared) == expected
+        assert map_batches(_bump, clocks, pool=pool, batch_size=3, shared=shared) == expected
+    finally:
+        pool.close()
+        pool.join()
+
+
+@needs_shared_memory
+def test_map_batches_shared_input(monkeypatch):
+    clocks = [VClockDictInt({1: i % 200}) for i in range(20)]
+    expected = [_bump(clock) for clock in clocks]
+    with VClockBatch.from_clocks(clocks).share() as shared:
+        # the existing block is reused, not re-encoded into a new one
+        monkeypatch.setattr(VClockBatch, 'from_clocks', None)
+        monkeypatch.setattr(VClockBatch, 'share', None)
+        assert map_batches(_bump, shared, processes=2, batch_size=1) == expected
+        # and left open for the caller
+        assert list(shared) == clocks
+
+
+def test_map_batches_bad_batch_size():
+    for size in (0, -1):
+        with raises(ValueError):
+            map_batches(_bump, [VClockArray([1])], batch_size=size)
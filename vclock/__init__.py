@@ -1 +1,2 @@
 from .clock import VClock, VClockArray, VClockDict, VClockDictInt
+from .batch import VClockBatch, SharedVClockBatch, map_batches
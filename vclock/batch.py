@@ -0,0 +1,308 @@
+import os
+import sys
+from array import array
+from multiprocessing import Pool
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    # only available from python 3.8
+    shared_memory = None
+
+from .clock import VClock
+
+# sizes of the native unsigned ints used in the shared memory header
+_INT_BYTES = array('I').itemsize
+_TRACKER_BYTES = 2 * array('Q').itemsize
+# before python 3.13, every process that attaches to a block registers it with its resource tracker
+_UNTRACK_ON_ATTACH = shared_memory is not None and os.name == 'posix' and sys.version_info < (3, 13)
+
+
+class VClockBatch(object):
+    """
+    An immutable sequence of clocks of a single class, stored as the serialized
+    codec bytes of every clock concatenated into one buffer, plus a table of offsets.
+    Clocks are only deserialized when they are accessed, so a batch can wrap a buffer
+    it does not own (eg. shared memory) without copying it.
+
+    Pickling a batch sends just the bytes and offsets for its range, which is much
+    cheaper than pickling every clock on its own.
+
+    The offsets are stored as unsigned ints, so a batch must be smaller than 4GB.
+    """
+
+    def __init__(self, clock_class=VClock, data=b'', offsets=(0,)):
+        self.clock_class = clock_class
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_serialized(cls, lines, clock_class=VClock):
+        """
+        Build a batch from already serialized clocks (eg. ids read from a database),
+        without decoding them.
+        """
+        lines = [line.encode('utf-8') if hasattr(line, 'encode') else line for line in lines]
+        offsets = [0]
+        for line in lines:
+            offsets.append(offsets[-1] + len(line))
+        return cls(clock_class, b''.join(lines), array('I', offsets))
+
+    @classmethod
+    def from_clocks(cls, clocks, clock_class=None):
+        """
+        Build a batch by serializing every clock.
+        All clocks must be of the same class, which is guessed from the first clock if not given.
+        """
+        clocks = list(clocks)
+        if clock_class is None:
+            clock_class = clocks[0].__class__ if clocks else VClock
+        for clock in clocks:
+            if clock.__class__ is not clock_class:
+                raise TypeError('Expected {}, got {}'.format(clock_class.__name__, clock.__class__.__name__))
+            if not clock.codec.can_encode(clock.vector):
+                raise ValueError('{} cannot be serialized by its codec'.format(clock))
+        return cls.from_serialized((clock.serialize() for clock in clocks), clock_class)
+
+    def serialized(self, idx):
+        """Return the serialized bytes of one clock without decoding it"""
+        idx = self._check_index(idx)
+        return bytes(self.data[self.offsets[idx]:self.offsets[idx + 1]])
+
+    def share(self):
+        """Copy this batch into a new shared memory block, see SharedVClockBatch"""
+        return SharedVClockBatch.create(self)
+
+    def _check_index(self, idx):
+        size = len(self)
+        if idx < 0:
+            idx += size
+        if not 0 <= idx < size:
+            raise IndexError('batch index out of range')
+        return idx
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        """
+        batch[i] returns the deserialized clock
+        batch[i:j] returns a new VClockBatch sharing the same buffer, with a copy of its offsets
+        """
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self))
+            if step != 1:
+                raise ValueError('VClockBatch slices do not support a step')
+            # copy the offsets, so a slice of a shared batch holds no view of its own on the block
+            offsets = array('I', self.offsets[start:max(start, stop) + 1])
+            return self.__class__(self.clock_class, self.data, offsets)
+        return self.clock_class.deserialize(self.serialized(idx))
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def __reduce__(self):
+        # only send the bytes in our range, rebased to start at 0
+        base = self.offsets[0]
+        data = bytes(self.data[base:self.offsets[-1]])
+        offsets = array('I', (offset - base for offset in self.offsets))
+        return (self.__class__, (self.clock_class, data, offsets))
+
+    def __str__(self):
+        return '<{}: {} x {}>'.format(self.__class__.__name__, len(self), self.clock_class.__name__)
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class SharedVClockBatch(object):
+    """
+    A VClockBatch placed in a multiprocessing.shared_memory block (python 3.8+).
+
+    Pickling this object only sends the name of the block, so passing it to a worker
+    process is constant cost no matter how many clocks it holds.  The worker attaches
+    to the same block and reads clocks straight out of it through the .batch attribute.
+
+    The block layout is [tracker] as two native unsigned long longs, identifying the
+    owner's resource tracker (python < 3.13 only, else zeros), then [count, offsets[0..count]]
+    as native unsigned ints, followed by the concatenated codec bytes.  The tracker lets
+    attach() tell whether it shares that tracker or must unregister the block.
+
+    The process that created the block owns it and must unlink() it when done;
+    using the object as a context manager closes it, and unlinks it in the owner.
+    Slices of .batch share its buffer and stop working once it is closed.
+    Any memoryview taken from .batch.data must be released before closing.
+    """
+
+    def __init__(self, shm, clock_class, owner=False):
+        self.shm = shm
+        self.clock_class = clock_class
+        self.owner = owner
+        view = shm.buf
+        with view[:_TRACKER_BYTES].cast('Q') as head:
+            self.tracker = tuple(head) if any(head) else None
+        with view[_TRACKER_BYTES:_TRACKER_BYTES + _INT_BYTES].cast('I') as head:
+            count = head[0]
+        start = _TRACKER_BYTES + _INT_BYTES * (count + 2)
+        self._offsets = view[_TRACKER_BYTES + _INT_BYTES:start].cast('I')
+        self._data = view[start:start + self._offsets[-1]]
+        self.batch = VClockBatch(clock_class, self._data, self._offsets)
+
+    @classmethod
+    def create(cls, batch):
+        """Create a new shared memory block holding a copy of this batch"""
+        _require_shared_memory()
+        # rebase the offsets, in case this is a slice of a larger batch
+        base = batch.offsets[0]
+        data = batch.data[base:batch.offsets[-1]]
+        header = array('I', [len(batch)])
+        header.extend(offset - base for offset in batch.offsets)
+        header = array('Q', _tracker_id() or (0, 0)).tobytes() + header.tobytes()
+        size = len(header) + len(data)
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        shm.buf[:len(header)] = header
+        shm.buf[len(header):size] = data
+        return cls(shm, batch.clock_class, owner=True)
+
+    @classmethod
+    def attach(cls, name, clock_class=VClock):
+        """Attach to a block created by another process"""
+        _require_shared_memory()
+        if sys.version_info >= (3, 13):
+            return cls(shared_memory.SharedMemory(name=name, track=False), clock_class)
+        result = cls(shared_memory.SharedMemory(name=name), clock_class)
+        if _UNTRACK_ON_ATTACH and result.tracker != _tracker_id():
+            # only the owner should track the block, otherwise our tracker would
+            # unlink it when this process exits.  If we share the owner's tracker,
+            # registering again was a no-op and unregistering would drop its entry.
+            resource_tracker.unregister(result.shm._name, 'shared_memory')
+        return result
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def close(self):
+        """Release our views and close this process' handle on the block"""
+        self.batch = None
+        self._data.release()
+        self._offsets.release()
+        self.shm.close()
+
+    def unlink(self):
+        """Free the block, once all processes have closed it"""
+        self.shm.unlink()
+
+    def __len__(self):
+        return len(self.batch)
+
+    def __getitem__(self, idx):
+        return self.batch[idx]
+
+    def __iter__(self):
+        return iter(self.batch)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        try:
+            self.close()
+        finally:
+            if self.owner:
+                self.unlink()
+
+    def __reduce__(self):
+        return (_attach, (self.name, self.clock_class))
+
+    def __str__(self):
+        return '<{}: {} x {} in {}>'.format(self.__class__.__name__, len(self.batch),
+                                           self.clock_class.__name__, self.name)
+
+    def __repr__(self):
+        return self.__str__()
+
+
+def _require_shared_memory():
+    if shared_memory is None:
+        raise RuntimeError('SharedVClockBatch requires multiprocessing.shared_memory (python 3.8+)')
+
+
+def _tracker_id():
+    """
+    Identify this process' resource tracker, or None if blocks are not tracked.
+    Processes sharing a tracker, whether forked or spawned, hold the same pipe to it.
+    """
+    if not _UNTRACK_ON_ATTACH:
+        return None
+    stat = os.fstat(resource_tracker.getfd())
+    return (stat.st_dev, stat.st_ino)
+
+
+def _attach(name, clock_class):
+    """Module level hook so pickle can reattach to a shared batch"""
+    return SharedVClockBatch.attach(name, clock_class)
+
+
+def _apply_shared(task):
+    """Run func over one range of a shared batch, inside a worker process"""
+    func, name, clock_class, start, stop = task
+    # attach per task, as pool.map may unpickle several tasks of a chunk at once
+    with SharedVClockBatch.attach(name, clock_class) as source:
+        return [func(source.batch[idx]) for idx in range(start, stop)]
+
+
+def _apply(task):
+    """Run func over a pickled batch, inside a worker process"""
+    func, batch = task
+    return [func(clock) for clock in batch]
+
+
+def map_batches(func, clocks, pool=None, processes=None, batch_size=1024, shared=True):
+    """
+    Apply func to every clock using a process pool and return the results in order.
+
+    clocks may be a SharedVClockBatch, a VClockBatch or any iterable of clocks of the same class.
+    func must be picklable (ie. defined at module level) and is called once per clock.
+    Clocks are sent to the workers batch_size at a time, through one shared memory
+    block if shared is True and python supports it, otherwise as pickled VClockBatch slices.
+    A SharedVClockBatch is always read through its own block, which is left open for the caller.
+
+    If no pool is given, one is created with the given number of processes and closed afterwards.
+    """
+    if batch_size < 1:
+        raise ValueError('batch_size must be at least 1, got {}'.format(batch_size))
+    block = clocks if isinstance(clocks, SharedVClockBatch) else None
+    own_block = False
+    if block is not None:
+        batch = block.batch
+    elif isinstance(clocks, VClockBatch):
+        batch = clocks
+    else:
+        batch = VClockBatch.from_clocks(clocks)
+    if not len(batch):
+        return []
+    ranges = [(start, min(start + batch_size, len(batch))) for start in range(0, len(batch), batch_size)]
+
+    own_pool = pool is None
+    if own_pool:
+        pool = Pool(processes)
+    try:
+        if block is None and shared and shared_memory is not None:
+            block = batch.share()
+            own_block = True
+        if block is not None:
+            tasks = [(func, block.name, block.clock_class, start, stop) for start, stop in ranges]
+            results = pool.map(_apply_shared, tasks)
+        else:
+            tasks = [(func, batch[start:stop]) for start, stop in ranges]
+            results = pool.map(_apply, tasks)
+    finally:
+        if own_block:
+            block.close()
+            block.unlink()
+        if own_pool:
+            pool.close()
+            pool.join()
+    return [result for chunk in results for result in chunk]
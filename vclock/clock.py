@@ -117,6 +117,15 @@ class VClockArray(object):
     def deserialize(cls, line):
         return cls(cls.codec.decode_vector(line))
 
+    def __reduce__(self):
+        """
+        Pickle as a constructor call on the bare vector, skipping the generic
+        __dict__ state.  The codec bytes are not used here, as encoding them in
+        pure python costs far more than pickling a short list or dict.
+        Use VClockBatch to ship many clocks at once.
+        """
+        return (self.__class__, (self.vector,))
+
     def __gt__(self, clock):
         return self.after(clock)
 
@@ -12,6 +12,7 @@ class ArrayCodec(object):
     BASE = 62;
     DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz";
     REVERSE = {digit: idx for idx, digit in enumerate(DIGITS)}
+    MAX_COUNT = BASE ** COUNT_BYTES
 
     def encode_count(self, big):
         """This encodes a large integer < 62**4 ~= 14.7 million, into 4 ascii characters"""
@@ -41,6 +42,10 @@ class ArrayCodec(object):
         n = self.COUNT_BYTES
         return (self.decode_count(line[i:i+n]) for i in range(0, len(line), n))
 
+    def can_encode(self, vector):
+        """Returns True iff encode_vector round-trips this vector exactly"""
+        return all(0 <= x < self.MAX_COUNT for x in vector)
+
 
 class DictCodec(ArrayCodec):
     """
@@ -86,3 +91,10 @@ class DictCodec(ArrayCodec):
             result[self.decode_key(ekey)] = self.decode_count(eval)
         return result
 
+    def can_encode(self, vector):
+        """Returns True iff encode_vector round-trips this vector exactly"""
+        if not super(DictCodec, self).can_encode(vector.values()):
+            return False
+        if self.int_keys:
+            return all(0 <= key < 16 ** self.KEY_BYTES for key in vector)
+        return all(len(self.encode_key(key)) == self.KEY_BYTES for key in vector)